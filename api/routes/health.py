@@ -19,7 +19,7 @@ router = APIRouter()
 @router.get("/health", response_model=HealthResponse)
 async def health_check():
     """系统健康检查"""
-    start_time = time.time()
+    start_time = time.perf_counter()
     
     try:
         # 记录指标
@@ -33,7 +33,7 @@ async def health_check():
         }
         
         # 计算耗时
-        duration = time.time() - start_time
+        duration = time.perf_counter() - start_time
         health_check_duration.observe(duration)
         
         logger.info(f"健康检查完成，耗时: {duration:.3f}s")
@@ -47,7 +47,7 @@ async def health_check():
         
     except Exception as e:
         logger.error(f"健康检查失败: {e}")
-        duration = time.time() - start_time
+        duration = time.perf_counter() - start_time
         health_check_duration.observe(duration)
         
         return HealthResponse(
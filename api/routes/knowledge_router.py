@@ -3,10 +3,10 @@
 """
 import uuid
 from datetime import datetime
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from fastapi import APIRouter, Depends, HTTPException, Request, Query, UploadFile, File, status
 from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 
@@ -19,6 +19,10 @@ from utils.logging_config import logger
 
 router = APIRouter(prefix="/knowledge", tags=["knowledge"])
 
+# 批量接口单次请求的上限
+MAX_BATCH_CREATE_ITEMS = 50
+MAX_BATCH_UPLOAD_FILES = 20
+
 
 # =============================================================================
 # === 请求/响应模型 ===
@@ -31,6 +35,10 @@ class DatabaseCreateRequest(BaseModel):
     dimension: Optional[int] = 1536
 
 
+class DatabaseBatchCreateRequest(BaseModel):
+    items: List[DatabaseCreateRequest] = Field(min_length=1, max_length=MAX_BATCH_CREATE_ITEMS)
+
+
 class DatabaseUpdateRequest(BaseModel):
     name: Optional[str] = None
     description: Optional[str] = None
@@ -59,6 +67,87 @@ class QueryRequest(BaseModel):
     meta: Optional[Dict[str, Any]] = {}
 
 
+# =============================================================================
+# === 内部辅助函数 ===
+# =============================================================================
+
+async def _create_databases(db: Session, items: List[DatabaseCreateRequest]) -> List[Dict[str, Any]]:
+    """创建知识库记录并逐个初始化后端
+
+    所有记录在同一个事务中写入；单个后端初始化失败不影响已写入的记录，
+    失败信息记录在对应结果的 backend_status / backend_error 中
+    """
+    new_databases = [
+        KnowledgeDatabase(
+            db_id=f"kb_{uuid.uuid4().hex[:8]}",
+            name=item.name,
+            description=item.description,
+            embed_model=item.embed_model,
+            dimension=item.dimension
+        )
+        for item in items
+    ]
+    db.add_all(new_databases)
+    # 先flush拿到自增ID并记下返回字段，避免提交后逐条重新加载过期的记录
+    db.flush()
+    created = [
+        {"id": database.id, "db_id": database.db_id, "name": database.name}
+        for database in new_databases
+    ]
+    db.commit()
+    
+    results = []
+    for info, item in zip(created, items):
+        backend_status, backend_error = "created", None
+        try:
+            await knowledge_base.create_database(
+                database_name=item.name,
+                description=item.description,
+                kb_type="lightrag",  # 默认类型
+                embed_info={"embed_model": item.embed_model, "dimension": item.dimension}
+            )
+        except Exception as kb_error:
+            logger.warning(f"知识库后端初始化失败: {item.name}, {kb_error}")
+            backend_status, backend_error = "failed", str(kb_error)
+        
+        results.append({
+            **info,
+            "backend_status": backend_status,
+            "backend_error": backend_error
+        })
+    
+    return results
+
+
+async def _save_upload_file(file: UploadFile, db_id: Optional[str]) -> Tuple[Dict[str, Any], Optional[KnowledgeFile]]:
+    """读取并保存上传的文件，返回文件信息；指定了db_id时同时返回待写入的文件记录，由调用方提交"""
+    # 生成文件ID并读取文件内容
+    file_id = f"file_{uuid.uuid4().hex[:10]}"
+    content = await file.read()
+    
+    # 这里应该保存文件到磁盘或云存储，现在先模拟
+    file_path = f"/tmp/uploads/{file_id}_{file.filename}"
+    
+    new_file = None
+    if db_id:
+        new_file = KnowledgeFile(
+            file_id=file_id,
+            database_id=db_id,
+            filename=file.filename,
+            path=file_path,
+            file_type=file.content_type or "application/octet-stream",
+            status="uploaded"
+        )
+    
+    result = {
+        "file_id": file_id,
+        "filename": file.filename,
+        "size": len(content),
+        "content_type": file.content_type
+    }
+    return result, new_file
+
+
 # =============================================================================
 # === 数据库管理接口 ===
 # =============================================================================
@@ -114,45 +203,16 @@ async def create_database(
 ):
     """创建知识库"""
     try:
-        # 生成数据库ID
-        db_id = f"kb_{uuid.uuid4().hex[:8]}"
-        
-        # 创建数据库记录
-        new_database = KnowledgeDatabase(
-            db_id=db_id,
-            name=db_request.name,
-            description=db_request.description,
-            embed_model=db_request.embed_model,
-            dimension=db_request.dimension
-        )
-        
-        db.add(new_database)
-        db.commit()
-        db.refresh(new_database)
-        
-        # 初始化知识库（如果需要）
-        try:
-            await knowledge_base.create_database(
-                database_name=db_request.name,
-                description=db_request.description,
-                kb_type="lightrag",  # 默认类型
-                embed_info={"embed_model": db_request.embed_model, "dimension": db_request.dimension}
-            )
-        except Exception as kb_error:
-            logger.warning(f"知识库后端初始化失败: {kb_error}")
+        result, = await _create_databases(db, [db_request])
         
-        log_operation(db, current_user.id, "创建知识库", f"创建知识库: {db_request.name}, ID: {db_id}", request)
+        log_operation(db, current_user.id, "创建知识库", f"创建知识库: {db_request.name}, ID: {result['db_id']}", request)
         
         logger.info(f"用户 {current_user.username} 创建知识库: {db_request.name}")
         
         return {
             "success": True,
             "message": "知识库创建成功",
-            "data": {
-                "id": new_database.id,
-                "db_id": db_id,
-                "name": new_database.name
-            }
+            "data": result
         }
         
     except Exception as e:
@@ -163,6 +223,37 @@ async def create_database(
         )
 
 
+@router.post("/databases/batch", response_model=dict)
+async def batch_create_databases(
+    request: Request,
+    batch_request: DatabaseBatchCreateRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """批量创建知识库，所有记录在同一个事务中写入，返回每个知识库的后端初始化状态"""
+    try:
+        results = await _create_databases(db, batch_request.items)
+        
+        db_ids = [item["db_id"] for item in results]
+        log_operation(db, current_user.id, "批量创建知识库", f"批量创建知识库，数量: {len(db_ids)}, ID: {', '.join(db_ids)}", request)
+        
+        logger.info(f"用户 {current_user.username} 批量创建知识库，数量: {len(db_ids)}")
+        
+        return {
+            "success": True,
+            "message": "知识库批量创建成功",
+            "data": results
+        }
+        
+    except Exception as e:
+        db.rollback()
+        logger.error(f"批量创建知识库失败: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"批量创建知识库失败: {str(e)}"
+        )
+
+
 @router.get("/databases/{db_id}", response_model=dict)
 async def get_database_info(
     request: Request,
@@ -637,39 +728,18 @@ async def upload_file(
                     detail="知识库不存在"
                 )
         
-        # 生成文件ID和路径
-        file_id = f"file_{uuid.uuid4().hex[:10]}"
-        
-        # 读取文件内容
-        content = await file.read()
-        
-        # 这里应该保存文件到磁盘或云存储，现在先模拟
-        file_path = f"/tmp/uploads/{file_id}_{file.filename}"
-        
-        # 如果指定了db_id，创建文件记录
-        if db_id:
-            new_file = KnowledgeFile(
-                file_id=file_id,
-                database_id=db_id,
-                filename=file.filename,
-                path=file_path,
-                file_type=file.content_type or "application/octet-stream",
-                status="uploaded"
-            )
+        # 保存文件，如果指定了db_id，创建文件记录
+        result, new_file = await _save_upload_file(file, db_id)
+        if new_file:
             db.add(new_file)
             db.commit()
         
-        log_operation(db, current_user.id, "上传文件", f"上传文件: {file.filename}, ID: {file_id}", request)
+        log_operation(db, current_user.id, "上传文件", f"上传文件: {file.filename}, ID: {result['file_id']}", request)
         
         return {
             "success": True,
             "message": "文件上传成功",
-            "data": {
-                "file_id": file_id,
-                "filename": file.filename,
-                "size": len(content),
-                "content_type": file.content_type
-            }
+            "data": result
         }
         
     except HTTPException:
@@ -682,6 +752,72 @@ async def upload_file(
         )
 
 
+@router.post("/files/upload/batch", response_model=dict)
+async def batch_upload_files(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    db_id: Optional[str] = Query(None, description="知识库ID"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """批量上传文件，所有文件记录在同一个事务中写入"""
+    try:
+        # 限制单次上传的文件数量，避免一次请求把任意多的文件读入内存
+        if len(files) > MAX_BATCH_UPLOAD_FILES:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"单次最多上传 {MAX_BATCH_UPLOAD_FILES} 个文件"
+            )
+        
+        # 检查文件名
+        if any(not file.filename for file in files):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="文件名不能为空"
+            )
+        
+        # 如果指定了db_id，检查数据库是否存在
+        if db_id:
+            database = db.query(KnowledgeDatabase).filter(KnowledgeDatabase.db_id == db_id).first()
+            if not database:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="知识库不存在"
+                )
+        
+        results = []
+        new_files = []
+        for file in files:
+            result, new_file = await _save_upload_file(file, db_id)
+            results.append(result)
+            if new_file:
+                new_files.append(new_file)
+        
+        # 如果指定了db_id，统一提交所有文件记录
+        if new_files:
+            db.add_all(new_files)
+            db.commit()
+        
+        file_ids = [item["file_id"] for item in results]
+        log_operation(db, current_user.id, "批量上传文件", f"批量上传文件，数量: {len(file_ids)}, ID: {', '.join(file_ids)}", request)
+        
+        return {
+            "success": True,
+            "message": "文件批量上传成功",
+            "data": results
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        db.rollback()
+        logger.error(f"文件批量上传失败: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"文件批量上传失败: {str(e)}"
+        )
+
+
 # =============================================================================
 # === 知识库类型和统计接口 ===
 # =============================================================================
@@ -62,7 +62,7 @@ class AuthUtils:
         try:
             payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
             return payload
-        except jwt.PyJWTError:
+        except jwt.JWTError:
             return None
 
     @staticmethod
@@ -73,5 +73,5 @@ class AuthUtils:
             return payload
         except jwt.ExpiredSignatureError:
             raise ValueError("令牌已过期")
-        except jwt.InvalidTokenError:
+        except jwt.JWTError:
             raise ValueError("无效的令牌")
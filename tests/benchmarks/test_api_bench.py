@@ -0,0 +1,23 @@
+"""
+API热路径基准测试
+默认不运行，使用 `pytest -m benchmark --benchmark-autosave` 记录基线，
+使用 `pytest -m benchmark --benchmark-compare --benchmark-compare-fail=mean:10%` 检测回归
+"""
+import pytest
+from fastapi.testclient import TestClient
+
+pytest.importorskip("pytest_benchmark")
+
+pytestmark = pytest.mark.benchmark(group="api")
+
+
+def test_health_bench(benchmark, client: TestClient):
+    """健康检查接口耗时"""
+    response = benchmark(client.get, "/api/health")
+    assert response.status_code == 200
+
+
+def test_liveness_bench(benchmark, client: TestClient):
+    """存活检查接口耗时"""
+    response = benchmark(client.get, "/api/live")
+    assert response.status_code == 200
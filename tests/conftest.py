@@ -3,34 +3,34 @@
 配置测试夹具和环境设置
 """
 import os
-import uuid
-import asyncio
+import socket
+import functools
+import itertools
+import sqlite3
 import pytest
+import pytest_asyncio
 
-from typing import Generator
-from unittest.mock import Mock, patch
+from dataclasses import dataclass
+from typing import AsyncGenerator, Generator
+from unittest.mock import AsyncMock, Mock, patch
 from fastapi.testclient import TestClient
+import httpx
+from httpx import ASGITransport, AsyncClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import StaticPool
 
-# 数据库导入（仅在需要时导入以避免依赖问题）
 try:
-    from pymilvus import connections, utility
-    MILVUS_AVAILABLE = True
+    import orjson
+    ORJSON_AVAILABLE = True
 except ImportError:
-    MILVUS_AVAILABLE = False
+    ORJSON_AVAILABLE = False
 
 try:
-    from neo4j import GraphDatabase
-    NEO4J_AVAILABLE = True
+    import uvloop
+    UVLOOP_AVAILABLE = True
 except ImportError:
-    NEO4J_AVAILABLE = False
-
-try:
-    from minio import Minio
-    MINIO_AVAILABLE = True
-except ImportError:
-    MINIO_AVAILABLE = False
+    UVLOOP_AVAILABLE = False
 
 # 设置测试环境变量
 os.environ["TESTING"] = "1"
@@ -40,27 +40,99 @@ os.environ["NEO4J_PASSWORD"] = "embedai123"
 os.environ["MINIO_ENDPOINT"] = "localhost:10106"
 os.environ["MINIO_SECRET_KEY"] = "minioadmin"
 
+# pytest-xdist 工作进程标识，用于隔离各进程共享的文件资源
+XDIST_WORKER = os.environ.get("PYTEST_XDIST_WORKER", "master")
+INTEGRATION_DB_PATH = f"./test_embedai_{XDIST_WORKER}.db"
+
 # 延迟导入以避免循环依赖
 from main import app
 from api.models import Base
-from api.utils.auth_middleware import get_db
+from api.models.user_model import User
+from api.utils.auth_middleware import get_admin_user, get_current_user, get_db
+from api.utils.auth_utils import AuthUtils
 
+# 批量写入的测试用户共用一个预先计算的密码哈希（明文为 testpass）
+TEST_PASSWORD_HASH = AuthUtils.hash_password("testpass")
 
-@pytest.fixture(scope="session")
-def event_loop():
-    """创建事件循环"""
-    loop = asyncio.new_event_loop()
-    yield loop
-    loop.close()
+# 唯一后缀的进程内计数器
+_suffix_counter = itertools.count()
 
 
-@pytest.fixture
+def _unique_suffix() -> str:
+    """生成唯一后缀：xdist进程ID + 进程内单调计数，无需系统随机数"""
+    return f"{XDIST_WORKER}{next(_suffix_counter):08x}"
+
+
+def _bearer_header(token: str) -> dict:
+    """生成Bearer认证请求头"""
+    return {"Authorization": f"Bearer {token}"}
+
+
+def pytest_addoption(parser):
+    """注册命令行选项"""
+    parser.addoption(
+        "--run-integration",
+        action="store_true",
+        default=False,
+        help="运行依赖外部服务（Milvus/Neo4j/MinIO）的集成测试",
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    """未指定 --run-integration 时跳过集成测试，避免本地等待外部服务连接超时"""
+    if config.getoption("--run-integration"):
+        return
+    skip_integration = pytest.mark.skip(reason="集成测试需使用 --run-integration 运行")
+    for item in items:
+        if "integration" in item.keywords:
+            item.add_marker(skip_integration)
+
+
+if UVLOOP_AVAILABLE:
+    @pytest.fixture(scope="session")
+    def event_loop_policy():
+        """安装了uvloop时，pytest-asyncio 创建的事件循环改用uvloop；未安装时沿用默认策略"""
+        return uvloop.EventLoopPolicy()
+
+
+def _orjson_response_json(response: httpx.Response, **kwargs):
+    """使用orjson解析响应JSON；带参数调用或响应不是UTF-8编码时交给httpx原实现"""
+    if kwargs or (response.charset_encoding or "utf-8").lower().replace("-", "") != "utf8":
+        return httpx.Response.json(response, **kwargs)
+    return orjson.loads(response.content)
+
+
+def _use_orjson(response: httpx.Response) -> None:
+    """响应钩子：只替换测试客户端收到的响应的 json()，不影响应用自身的httpx客户端"""
+    response.json = functools.partial(_orjson_response_json, response)
+
+
+async def _use_orjson_async(response: httpx.Response) -> None:
+    """异步客户端的响应钩子"""
+    _use_orjson(response)
+
+
+# 测试客户端的响应钩子，未安装orjson时不注册
+RESPONSE_HOOKS = {"response": [_use_orjson]} if ORJSON_AVAILABLE else {}
+ASYNC_RESPONSE_HOOKS = {"response": [_use_orjson_async]} if ORJSON_AVAILABLE else {}
+
+
+@pytest.fixture(scope="session")
 def client() -> Generator[TestClient, None, None]:
-    """创建测试客户端"""
+    """创建测试客户端，整个测试会话只启动一次应用"""
     with TestClient(app) as test_client:
+        test_client.event_hooks = RESPONSE_HOOKS
         yield test_client
 
 
+@pytest_asyncio.fixture(scope="module", loop_scope="module")
+async def async_client() -> AsyncGenerator[AsyncClient, None]:
+    """创建异步测试客户端，绕过TestClient的同步线程桥接；同一模块内只启动一次应用"""
+    async with app.router.lifespan_context(app):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test", event_hooks=ASYNC_RESPONSE_HOOKS) as c:
+            yield c
+
+
 @pytest.fixture
 def mock_db() -> Generator[Mock, None, None]:
     """模拟数据库会话"""
@@ -75,28 +147,50 @@ def mock_db() -> Generator[Mock, None, None]:
     yield db
 
 
-@pytest.fixture
-def mock_user():
+@pytest.fixture(scope="session")
+def async_mock_factory():
+    """按名称复用AsyncMock实例的工厂
+
+    AsyncMock创建时需要预先装配异步魔术方法，开销不小；同名mock在会话内只创建一次，
+    再次获取时重置调用记录、return_value 和 side_effect 后复用。
+    """
+    pool = {}
+
+    def _factory(name: str, return_value=None, side_effect=None) -> AsyncMock:
+        async_mock = pool.get(name)
+        if async_mock is None:
+            async_mock = pool[name] = AsyncMock()
+        else:
+            async_mock.reset_mock(return_value=True, side_effect=True)
+        async_mock.return_value = return_value
+        async_mock.side_effect = side_effect
+        return async_mock
+
+    return _factory
+
+
+@dataclass(frozen=True, slots=True)
+class FakeUser:
+    """只读的模拟用户，比 Mock 构造开销更低，误写属性会直接报错"""
+
+    id: int = 1
+    username: str = "testuser"
+    email: str = "test@example.com"
+    role: str = "user"
+    is_admin: bool = False
+    is_active: bool = True
+
+
+@pytest.fixture(scope="session")
+def mock_user() -> FakeUser:
     """创建模拟用户"""
-    user = Mock()
-    user.id = 1
-    user.username = "testuser"
-    user.email = "test@example.com"
-    user.is_admin = False
-    user.is_active = True
-    return user
+    return FakeUser()
 
 
-@pytest.fixture
-def mock_admin_user():
+@pytest.fixture(scope="session")
+def mock_admin_user() -> FakeUser:
     """创建模拟管理员用户"""
-    user = Mock()
-    user.id = 1
-    user.username = "admin"
-    user.email = "admin@example.com"
-    user.is_admin = True
-    user.is_active = True
-    return user
+    return FakeUser(username="admin", email="admin@example.com", role="admin", is_admin=True)
 
 
 @pytest.fixture
@@ -107,7 +201,7 @@ def override_get_db(mock_db):
     return _override_get_db
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def override_get_current_user(mock_user):
     """重写当前用户依赖"""
     def _override_get_current_user():
@@ -115,7 +209,7 @@ def override_get_current_user(mock_user):
     return _override_get_current_user
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def override_get_admin_user(mock_admin_user):
     """重写管理员用户依赖"""
     def _override_get_admin_user():
@@ -123,13 +217,44 @@ def override_get_admin_user(mock_admin_user):
     return _override_get_admin_user
 
 
+@pytest.fixture
+def override_auth(override_get_current_user, override_get_admin_user) -> Generator[None, None, None]:
+    """通过依赖覆盖注入模拟用户和管理员，替代逐个测试的patch认证函数
+
+    覆盖函数在会话内只创建一次；覆盖按测试安装和移除，避免影响走真实认证流程的测试
+    """
+    overrides = {
+        get_current_user: override_get_current_user,
+        get_admin_user: override_get_admin_user,
+    }
+    app.dependency_overrides.update(overrides)
+    yield
+    for dependency in overrides:
+        app.dependency_overrides.pop(dependency, None)
+
+
 # =============================================================================
 # === 真实数据库连接测试夹具 ===
 # =============================================================================
 
+def _skip_if_unreachable(name: str, host: str, port: int, timeout: float = 0.25) -> None:
+    """先做一次快速TCP探测，服务未启动时立即跳过，避免客户端连接超时的长时间等待"""
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            pass
+    except OSError:
+        pytest.skip(f"{name}服务不可达: {host}:{port}")
+
+
 @pytest.fixture(scope="session")
 def real_milvus_connection():
-    """真实Milvus连接"""
+    """真实Milvus连接，整个会话（每个xdist进程）只建立一次"""
+    # 延迟导入SDK，避免收集阶段加载客户端库
+    try:
+        from pymilvus import connections
+    except ImportError:
+        pytest.skip("未安装pymilvus")
+    _skip_if_unreachable("Milvus", "localhost", 10130)
     try:
         connections.connect(
             alias="default",
@@ -142,9 +267,14 @@ def real_milvus_connection():
         pytest.skip(f"无法连接到Milvus: {e}")
 
 
-@pytest.fixture(scope="session") 
+@pytest.fixture(scope="session")
 def real_neo4j_driver():
-    """真实Neo4j连接"""
+    """真实Neo4j连接，驱动内部维护连接池，可在测试间共享"""
+    try:
+        from neo4j import GraphDatabase
+    except ImportError:
+        pytest.skip("未安装neo4j驱动")
+    _skip_if_unreachable("Neo4j", "localhost", 10105)
     try:
         driver = GraphDatabase.driver(
             "bolt://localhost:10105",
@@ -161,7 +291,12 @@ def real_neo4j_driver():
 
 @pytest.fixture(scope="session")
 def real_minio_client():
-    """真实MinIO连接"""
+    """真实MinIO连接，整个会话（每个xdist进程）只创建一次"""
+    try:
+        from minio import Minio
+    except ImportError:
+        pytest.skip("未安装minio")
+    _skip_if_unreachable("MinIO", "localhost", 10106)
     try:
         client = Minio(
             "localhost:10106",
@@ -180,45 +315,33 @@ def real_minio_client():
 # === 数据库集成测试夹具 ===
 # =============================================================================
 
-# 延迟导入，避免循环引用
-
-
-@pytest.fixture(scope="function")
-def test_db_session(request) -> Generator[sessionmaker, None, None]:
-    """为每个测试函数创建一个独立的SQLite数据库"""
-    # 使用测试函数名作为数据库文件名的一部分
-    test_name = request.node.name
-    db_path = f"./test_{test_name}_{uuid.uuid4().hex[:8]}.sqlite"
-    
-    # 确保数据库文件不存在
-    if os.path.exists(db_path):
-        os.remove(db_path)
-        
-    # 创建引擎和会话工厂
-    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+@pytest.fixture(scope="session")
+def test_db_session() -> Generator[sessionmaker, None, None]:
+    """整个测试会话（每个xdist进程）共享一个内存SQLite测试数据库，测试间通过 reset_test_db 重置数据
+
+    StaticPool 保证所有会话复用同一个连接，从而看到同一个内存数据库
+    """
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
     TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
     # 创建表
-    from api.models import Base
     Base.metadata.create_all(bind=engine)
     
     yield TestingSessionLocal
 
-    # 清理数据库文件
-    if os.path.exists(db_path):
-        os.remove(db_path)
+    engine.dispose()
 
 
-@pytest.fixture()
-def db_client(test_db_session: sessionmaker) -> Generator[TestClient, None, None]:
-    """提供一个使用真实数据库会话的TestClient"""
+@pytest.fixture(scope="session")
+def test_db_overrides(test_db_session: sessionmaker) -> Generator[sessionmaker, None, None]:
+    """将应用的数据库依赖切换为测试数据库"""
     # 获取引擎
     engine = test_db_session.kw['bind']
     
-    # 确保数据库已经创建好表结构
-    from api.models import Base
-    Base.metadata.create_all(bind=engine)
-    
     # 修改全局数据库管理器的连接
     from api.db_manager import db_manager
     original_engine = db_manager.engine
@@ -239,16 +362,194 @@ def db_client(test_db_session: sessionmaker) -> Generator[TestClient, None, None
     # 应用依赖覆盖
     app.dependency_overrides[get_db] = override_get_db
     
-    with TestClient(app) as c:
-        yield c
+    yield test_db_session
         
     # 恢复原始数据库连接
     db_manager.engine = original_engine
     db_manager.Session = original_session
     app.dependency_overrides.pop(get_db, None)
-    
-    # 清理依赖覆盖
-    app.dependency_overrides.clear()
+
+
+def _snapshot_test_db(engine) -> sqlite3.Connection:
+    """通过sqlite3备份API把测试数据库整体复制到一个独立的内存连接中"""
+    snapshot = sqlite3.connect(":memory:", check_same_thread=False)
+    raw = engine.raw_connection()
+    try:
+        raw.driver_connection.backup(snapshot)
+    finally:
+        raw.close()
+    return snapshot
+
+
+def _restore_test_db(engine, snapshot: sqlite3.Connection):
+    """用快照整体覆盖测试数据库"""
+    raw = engine.raw_connection()
+    try:
+        snapshot.backup(raw.driver_connection)
+    finally:
+        raw.close()
+
+
+@pytest.fixture(scope="session")
+def empty_db_snapshot(test_db_session: sessionmaker) -> Generator[sqlite3.Connection, None, None]:
+    """只含表结构的空库快照"""
+    snapshot = _snapshot_test_db(test_db_session.kw['bind'])
+    yield snapshot
+    snapshot.close()
+
+
+@pytest.fixture(autouse=True)
+def reset_test_db(request):
+    """使用测试数据库的测试开始前从快照恢复数据，保证共享数据库下测试间相互隔离
+
+    使用 admin_ctx 的测试会恢复到管理员已初始化的状态，其余测试得到空库
+    """
+    if "test_db_overrides" in request.fixturenames:
+        engine = request.getfixturevalue("test_db_session").kw['bind']
+        if "admin_ctx" in request.fixturenames:
+            snapshot = request.getfixturevalue("admin_bootstrap")[1]
+        else:
+            snapshot = request.getfixturevalue("empty_db_snapshot")
+        _restore_test_db(engine, snapshot)
+    yield
+
+
+@dataclass(frozen=True)
+class AdminContext:
+    """已初始化管理员的认证信息"""
+
+    token: str
+    headers: dict
+    user_id: int
+    username: str
+
+
+@pytest.fixture(scope="session")
+def admin_bootstrap(db_client: TestClient, test_db_session: sessionmaker, empty_db_snapshot: sqlite3.Connection):
+    """整个测试会话只调用一次 /api/auth/initialize，并保存初始化后的数据库快照"""
+    engine = test_db_session.kw['bind']
+    _restore_test_db(engine, empty_db_snapshot)
+
+    username = "admin_ctx"
+    response = db_client.post("/api/auth/initialize", json={"username": username, "password": "adminpass"})
+    assert response.status_code == 200
+    data = response.json()
+    ctx = AdminContext(
+        token=data["access_token"],
+        headers=_bearer_header(data["access_token"]),
+        user_id=data["user_id"],
+        username=username,
+    )
+
+    snapshot = _snapshot_test_db(engine)
+    yield ctx, snapshot
+    snapshot.close()
+
+
+@pytest.fixture
+def admin_ctx(admin_bootstrap) -> AdminContext:
+    """提供已初始化的管理员，数据库在测试开始前由 reset_test_db 恢复到初始化后的状态"""
+    return admin_bootstrap[0]
+
+
+@pytest.fixture(scope="session")
+def unique_suffix():
+    """返回生成唯一后缀的函数，用于拼接测试用户名、知识库名等"""
+    return _unique_suffix
+
+
+@pytest.fixture(scope="session")
+def bearer():
+    """返回根据令牌生成Bearer认证请求头的函数"""
+    return _bearer_header
+
+
+@pytest.fixture(scope="session")
+def random_username():
+    """返回生成唯一用户名的函数"""
+    def _random_username(prefix: str = "user") -> str:
+        return f"{prefix}_{_unique_suffix()}"
+
+    return _random_username
+
+
+@pytest.fixture
+def bulk_create_users(test_db_overrides: sessionmaker):
+    """直接通过ORM批量写入测试用户，替代逐个调用 /api/auth/users"""
+    def _bulk_create(count: int, prefix: str = "user", role: str = "user") -> list[str]:
+        suffix = _unique_suffix()
+        usernames = [f"{prefix}_{i}_{suffix}" for i in range(count)]
+        with test_db_overrides() as session:
+            session.bulk_insert_mappings(
+                User,
+                [{"username": name, "password_hash": TEST_PASSWORD_HASH, "role": role} for name in usernames],
+            )
+            session.commit()
+        return usernames
+
+    return _bulk_create
+
+
+@pytest.fixture(scope="session")
+def auth_header():
+    """直接用应用的密钥签发JWT并返回认证请求头，跳过 /api/auth/token 登录流程"""
+    def _auth_header(user_id) -> dict:
+        return _bearer_header(AuthUtils.create_access_token({"sub": str(user_id)}))
+
+    return _auth_header
+
+
+@pytest.fixture
+def created_user(test_db_overrides: sessionmaker, bulk_create_users) -> dict:
+    """直接写入一个密码为 testpass 的普通用户，返回其 id 和 username"""
+    username, = bulk_create_users(1, prefix="normal_user")
+    with test_db_overrides() as session:
+        user_id = session.query(User.id).filter(User.username == username).scalar()
+    return {"id": user_id, "username": username}
+
+
+@pytest.fixture
+def user_headers(created_user: dict, auth_header) -> dict:
+    """普通用户的认证请求头，只在需要普通用户身份的测试中生成"""
+    return auth_header(created_user["id"])
+
+
+@pytest.fixture(scope="session")
+def db_client(test_db_overrides: sessionmaker) -> Generator[TestClient, None, None]:
+    """提供一个使用真实数据库会话的TestClient，整个测试会话只启动一次应用"""
+    with TestClient(app) as c:
+        c.event_hooks = RESPONSE_HOOKS
+        yield c
+
+
+@pytest_asyncio.fixture(scope="module", loop_scope="module")
+async def async_db_client(test_db_overrides: sessionmaker) -> AsyncGenerator[AsyncClient, None]:
+    """提供一个使用真实数据库会话的异步客户端，请求直接在事件循环中执行；同一模块内只启动一次应用"""
+    async with app.router.lifespan_context(app):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test", event_hooks=ASYNC_RESPONSE_HOOKS) as c:
+            yield c
+
+
+@pytest.fixture
+def make_kb(async_db_client: AsyncClient):
+    """通过接口创建知识库的异步工厂，返回新知识库的 db_id；需要认证时传入 headers"""
+    async def _make_kb(name: str, headers: dict | None = None, **fields) -> str:
+        response = await async_db_client.post("/api/knowledge/databases", json={"name": name, **fields}, headers=headers)
+        assert response.status_code == 200
+        return response.json()["data"]["db_id"]
+
+    return _make_kb
+
+
+@pytest.fixture(autouse=True)
+def mock_create_kb_backend(async_mock_factory, monkeypatch):
+    """模拟知识库后端的创建，避免测试创建知识库时初始化后端实例并在 data/ 下写入元数据
+
+    知识库管理器是全局单例，替换其方法即可覆盖所有经由接口创建知识库的测试
+    """
+    mock_create = async_mock_factory("knowledge_base.create_database", return_value={})
+    monkeypatch.setattr("api.routes.knowledge_router.knowledge_base.create_database", mock_create)
+    return mock_create
 
 
 @pytest.fixture
@@ -256,7 +557,7 @@ def integration_client(real_milvus_connection, real_neo4j_driver, real_minio_cli
     """集成测试客户端 - 使用真实数据库"""
     
     # 创建测试数据库引擎
-    engine = create_engine("sqlite:///./test_embedai.db", echo=False)
+    engine = create_engine(f"sqlite:///{INTEGRATION_DB_PATH}", echo=False)
     TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
     
     def override_get_db():
@@ -269,12 +570,13 @@ def integration_client(real_milvus_connection, real_neo4j_driver, real_minio_cli
     app.dependency_overrides[get_db] = override_get_db
     
     with TestClient(app) as test_client:
+        test_client.event_hooks = RESPONSE_HOOKS
         yield test_client
     
     # 清理
-    app.dependency_overrides.clear()
-    if os.path.exists("./test_embedai.db"):
-        os.remove("./test_embedai.db")
+    app.dependency_overrides.pop(get_db, None)
+    if os.path.exists(INTEGRATION_DB_PATH):
+        os.remove(INTEGRATION_DB_PATH)
 
 
 @pytest.fixture
@@ -350,7 +652,7 @@ def cleanup_test_data():
     
     # 清理测试创建的文件
     test_files = [
-        "./test_embedai.db",
+        INTEGRATION_DB_PATH,
         "./test_data/",
         "./logs/test_*.log"
     ]
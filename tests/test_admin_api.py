@@ -2,53 +2,26 @@
 管理后台API测试
 """
 import pytest
-import uuid
-import random
-import string
-from fastapi.testclient import TestClient
+from httpx import AsyncClient
 from sqlalchemy.orm import Session
 
-# 标记所有测试为数据库测试
-pytestmark = pytest.mark.database
-
-# 生成唯一用户名后缀
-def unique_suffix():
-    return uuid.uuid4().hex[:8]
-    
-# 生成完全随机的用户名
-def random_username(prefix="user"):
-    random_str = ''.join(random.choice(string.ascii_letters) for _ in range(10))
-    return f"{prefix}_{random_str}_{unique_suffix()}"
+# 标记所有测试为数据库测试，并与模块级客户端共用同一事件循环
+pytestmark = [pytest.mark.database, pytest.mark.asyncio(loop_scope="module")]
 
 
 class TestAdminAPI:
     """测试管理后台API"""
 
-    def test_get_users(self, db_client: TestClient):
+    async def test_get_users(self, async_db_client: AsyncClient, admin_ctx, bulk_create_users):
         """测试获取用户列表接口"""
-        # 1. 初始化管理员
-        admin_username = random_username("admin_list")
-        admin_data = {"username": admin_username, "password": "adminpass"}
-        response = db_client.post("/api/auth/initialize", json=admin_data)
-        assert response.status_code == 200
-        admin_token = response.json()["access_token"]
+        # 1. 使用已初始化的管理员
+        headers = admin_ctx.headers
         
-        # 2. 创建多个测试用户
-        headers = {"Authorization": f"Bearer {admin_token}"}
-        created_usernames = []
-        for i in range(3):
-            username = random_username(f"testuser_{i}")
-            created_usernames.append(username)
-            new_user_data = {
-                "username": username, 
-                "password": "testpass", 
-                "role": "user"
-            }
-            response = db_client.post("/api/auth/users", json=new_user_data, headers=headers)
-            assert response.status_code == 200
+        # 2. 批量创建多个测试用户
+        created_usernames = bulk_create_users(3, prefix="testuser")
         
         # 3. 使用管理员API获取用户列表
-        response = db_client.get("/api/admin/users", headers=headers)
+        response = await async_db_client.get("/api/admin/users", headers=headers)
         assert response.status_code == 200
         users = response.json()
         
@@ -68,54 +41,34 @@ class TestAdminAPI:
             assert "role" in user
             assert "created_at" in user
 
-    def test_get_users_pagination(self, db_client: TestClient):
+    async def test_get_users_pagination(self, async_db_client: AsyncClient, admin_ctx, bulk_create_users):
         """测试获取用户列表接口的分页功能"""
-        # 1. 初始化管理员并创建多个用户
-        admin_username = random_username("admin_pagination")
-        admin_data = {"username": admin_username, "password": "adminpass"}
-        response = db_client.post("/api/auth/initialize", json=admin_data)
-        assert response.status_code == 200
-        admin_token = response.json()["access_token"]
-        headers = {"Authorization": f"Bearer {admin_token}"}
+        # 1. 使用已初始化的管理员创建多个用户
+        headers = admin_ctx.headers
 
-        for i in range(5):
-            new_user_data = {"username": random_username(f"page_user_{i}"), "password": "testpass", "role": "user"}
-            db_client.post("/api/auth/users", json=new_user_data, headers=headers)
+        bulk_create_users(5, prefix="page_user")
 
         # 2. 测试分页参数 limit
-        response = db_client.get("/api/admin/users?limit=2", headers=headers)
+        response = await async_db_client.get("/api/admin/users?limit=2", headers=headers)
         assert response.status_code == 200
         assert len(response.json()) == 2
 
         # 3. 测试分页参数 skip 和 limit
-        response = db_client.get("/api/admin/users?skip=1&limit=3", headers=headers)
+        response = await async_db_client.get("/api/admin/users?skip=1&limit=3", headers=headers)
         assert response.status_code == 200
         users = response.json()
         assert len(users) == 3
 
-    def test_get_system_stats(self, db_client: TestClient):
+    async def test_get_system_stats(self, async_db_client: AsyncClient, admin_ctx, bulk_create_users):
         """测试获取系统统计信息接口"""
-        # 1. 初始化管理员
-        admin_username = random_username("admin_stats")
-        admin_data = {"username": admin_username, "password": "adminpass"}
-        response = db_client.post("/api/auth/initialize", json=admin_data)
-        assert response.status_code == 200
-        admin_token = response.json()["access_token"]
+        # 1. 使用已初始化的管理员
+        headers = admin_ctx.headers
         
-        # 2. 创建测试用户
-        headers = {"Authorization": f"Bearer {admin_token}"}
-        for i in range(2):
-            username = random_username(f"testuser_{i}")
-            new_user_data = {
-                "username": username, 
-                "password": "testpass", 
-                "role": "user"
-            }
-            response = db_client.post("/api/auth/users", json=new_user_data, headers=headers)
-            assert response.status_code == 200
+        # 2. 批量创建测试用户
+        bulk_create_users(2, prefix="testuser")
         
         # 3. 获取系统统计信息
-        response = db_client.get("/api/admin/stats", headers=headers)
+        response = await async_db_client.get("/api/admin/stats", headers=headers)
         assert response.status_code == 200
         stats = response.json()
         
@@ -135,15 +88,10 @@ class TestAdminAPI:
         assert users_stats["admins"] >= 1  # 至少有1个管理员
         assert users_stats["regular"] >= 2  # 至少有2个普通用户
         
-    def test_create_and_delete_database(self, db_client: TestClient):
+    async def test_create_and_delete_database(self, async_db_client: AsyncClient, admin_ctx, unique_suffix):
         """测试创建和删除知识库数据库接口"""
-        # 1. 初始化管理员
-        admin_username = random_username("admin_db")
-        admin_data = {"username": admin_username, "password": "adminpass"}
-        response = db_client.post("/api/auth/initialize", json=admin_data)
-        assert response.status_code == 200
-        admin_token = response.json()["access_token"]
-        headers = {"Authorization": f"Bearer {admin_token}"}
+        # 1. 使用已初始化的管理员
+        headers = admin_ctx.headers
         
         # 2. 创建数据库
         db_name = f"test_db_{unique_suffix()}"
@@ -152,7 +100,7 @@ class TestAdminAPI:
             "description": "测试数据库",
             "embed_model": "test-embedding-model"
         }
-        response = db_client.post("/api/admin/databases", json=db_data, headers=headers)
+        response = await async_db_client.post("/api/admin/databases", json=db_data, headers=headers)
         assert response.status_code == 200
         result = response.json()
         
@@ -164,14 +112,14 @@ class TestAdminAPI:
         db_id = result["data"]["db_id"]
         
         # 4. 获取数据库列表，验证新创建的数据库存在
-        response = db_client.get("/api/admin/databases", headers=headers)
+        response = await async_db_client.get("/api/admin/databases", headers=headers)
         assert response.status_code == 200
         databases = response.json()
         db_names = [db["name"] for db in databases]
         assert db_name in db_names
         
         # 5. 获取数据库详情
-        response = db_client.get(f"/api/admin/databases/{db_id}", headers=headers)
+        response = await async_db_client.get(f"/api/admin/databases/{db_id}", headers=headers)
         assert response.status_code == 200
         db_detail = response.json()
         assert db_detail["success"] == True
@@ -181,35 +129,30 @@ class TestAdminAPI:
         assert "files" in db_detail["data"]
         
         # 6. 删除数据库
-        response = db_client.delete(f"/api/admin/databases/{db_id}", headers=headers)
+        response = await async_db_client.delete(f"/api/admin/databases/{db_id}", headers=headers)
         assert response.status_code == 200
         delete_result = response.json()
         assert delete_result["success"] == True
         
         # 7. 验证数据库已被删除
-        response = db_client.get(f"/api/admin/databases/{db_id}", headers=headers)
+        response = await async_db_client.get(f"/api/admin/databases/{db_id}", headers=headers)
         assert response.status_code == 404  # 应该返回404 Not Found
 
-    def test_get_operation_logs(self, db_client: TestClient):
+    async def test_get_operation_logs(self, async_db_client: AsyncClient, admin_ctx, random_username):
         """测试获取操作日志接口"""
-        # 1. 初始化管理员并获取其ID和令牌
-        admin_username = random_username("admin_logs")
-        admin_data = {"username": admin_username, "password": "adminpass"}
-        response = db_client.post("/api/auth/initialize", json=admin_data)
-        assert response.status_code == 200
-        admin_token = response.json()["access_token"]
-        admin_id = response.json()["user_id"]
-        headers = {"Authorization": f"Bearer {admin_token}"}
+        # 1. 使用已初始化的管理员的ID和令牌
+        admin_id = admin_ctx.user_id
+        headers = admin_ctx.headers
 
         # 2. 创建一个普通用户以生成更多日志
         user_username = random_username("log_user")
         user_data = {"username": user_username, "password": "testpass", "role": "user"}
-        response = db_client.post("/api/auth/users", json=user_data, headers=headers)
+        response = await async_db_client.post("/api/auth/users", json=user_data, headers=headers)
         assert response.status_code == 200
         user_id = response.json()["id"]
 
         # 3. 获取所有操作日志，验证有初始化、创建用户等操作
-        response = db_client.get("/api/admin/logs", headers=headers)
+        response = await async_db_client.get("/api/admin/logs", headers=headers)
         assert response.status_code == 200
         logs = response.json()
         assert len(logs) >= 2
@@ -218,55 +161,31 @@ class TestAdminAPI:
         assert "创建用户" in operations
 
         # 4. 按 user_id 筛选日志
-        response = db_client.get(f"/api/admin/logs?user_id={admin_id}", headers=headers)
+        response = await async_db_client.get(f"/api/admin/logs?user_id={admin_id}", headers=headers)
         assert response.status_code == 200
         admin_logs = response.json()
         assert len(admin_logs) > 0
-        for log in admin_logs:
-            assert log['user_id'] == admin_id
+        assert {log['user_id'] for log in admin_logs} == {admin_id}
 
         # 5. 按 operation 筛选日志
-        response = db_client.get('/api/admin/logs?operation=创建用户', headers=headers)
+        response = await async_db_client.get('/api/admin/logs?operation=创建用户', headers=headers)
         assert response.status_code == 200
         create_user_logs = response.json()
         assert len(create_user_logs) >= 1
         assert create_user_logs[0]['operation'] == "创建用户"
 
         # 6. 测试分页
-        response = db_client.get('/api/admin/logs?limit=1', headers=headers)
+        response = await async_db_client.get('/api/admin/logs?limit=1', headers=headers)
         assert response.status_code == 200
         assert len(response.json()) == 1
 
-    def test_admin_api_insufficient_permissions(self, db_client: TestClient):
+    @pytest.mark.parametrize("endpoint", [
+        "/api/admin/users",
+        "/api/admin/stats",
+        "/api/admin/logs",
+        "/api/admin/databases",
+    ])
+    async def test_admin_api_insufficient_permissions(self, async_db_client: AsyncClient, user_headers, endpoint):
         """测试普通用户无法访问管理后台API"""
-        # 1. 初始化管理员并创建普通用户
-        admin_username = random_username("admin_perm_api")
-        admin_data = {"username": admin_username, "password": "adminpass"}
-        response = db_client.post("/api/auth/initialize", json=admin_data)
-        assert response.status_code == 200
-        admin_token = response.json()["access_token"]
-        admin_headers = {"Authorization": f"Bearer {admin_token}"}
-
-        user_username = random_username("normal_user_api_perm")
-        new_user_data = {"username": user_username, "password": "testpass", "role": "user"}
-        response = db_client.post("/api/auth/users", json=new_user_data, headers=admin_headers)
-        assert response.status_code == 200
-
-        # 2. 普通用户登录获取令牌
-        login_data = {"username": user_username, "password": "testpass"}
-        response = db_client.post("/api/auth/token", data=login_data)
-        assert response.status_code == 200
-        user_token = response.json()["access_token"]
-        user_headers = {"Authorization": f"Bearer {user_token}"}
-
-        # 3. 尝试使用普通用户令牌访问所有管理后台端点
-        admin_endpoints = [
-            "/api/admin/users",
-            "/api/admin/stats",
-            "/api/admin/logs",
-            "/api/admin/databases"
-        ]
-
-        for endpoint in admin_endpoints:
-            response = db_client.get(endpoint, headers=user_headers)
-            assert response.status_code == 403
+        response = await async_db_client.get(endpoint, headers=user_headers)
+        assert response.status_code == 403
@@ -5,50 +5,58 @@
 import uuid
 
 import pytest
-from pymilvus import utility
 
 pytestmark = [pytest.mark.integration, pytest.mark.database]
 
 
+@pytest.mark.timeout(30)
 def test_milvus_list_collections(real_milvus_connection):
     """验证 Milvus 服务可用，能够列出集合并执行基础操作。"""
+    from pymilvus import utility
+
     collections = utility.list_collections(timeout=5)
     assert isinstance(collections, list)
 
 
+@pytest.mark.timeout(30)
 def test_neo4j_create_and_cleanup_node(real_neo4j_driver):
     """验证 Neo4j 服务可执行基本的 Cypher 写入与清理。"""
     label = f"TestNode_{uuid.uuid4().hex[:8]}"
     property_value = "embedai"
 
     with real_neo4j_driver.session() as session:
-        # 创建节点
-        created = session.run(
-            f"CREATE (n:{label} {{value: $value}}) RETURN n.value",
-            value=property_value,
-        ).single()
-        assert created is not None
-        assert created[0] == property_value
-
-        # 验证节点存在
-        exists_count = session.run(
-            f"MATCH (n:{label}) RETURN count(n)",
-        ).single()[0]
-        assert exists_count == 1
-
-        # 删除节点
-        deleted_count = session.run(
-            f"MATCH (n:{label}) DELETE n RETURN count(n)",
-        ).single()[0]
-        assert deleted_count == 1  # 应该删除了1个节点
+        # 在显式事务中执行，结束时回滚，断言失败也不会在共享库中残留节点
+        tx = session.begin_transaction()
+        try:
+            # 使用UNWIND批量创建节点，并在同一条查询中回读校验，减少Bolt往返
+            created = tx.run(
+                "UNWIND $items AS item "
+                f"CREATE (n:{label} {{value: item.value}}) "
+                "WITH collect(n.value) AS values "
+                f"MATCH (m:{label}) "
+                "RETURN values, count(m) AS exists_count",
+                items=[{"value": property_value}],
+            ).single()
+            assert created is not None
+            assert created["values"] == [property_value]
+            assert created["exists_count"] == 1
 
-        # 验证节点已被删除
-        final_count = session.run(
-            f"MATCH (n:{label}) RETURN count(n)",
-        ).single()[0]
-        assert final_count == 0  # 确认节点已被删除
+            # 删除节点并在同一条查询中确认已无残留
+            cleanup = tx.run(
+                f"MATCH (n:{label}) "
+                "WITH collect(n) AS nodes "
+                "FOREACH (n IN nodes | DETACH DELETE n) "
+                "WITH size(nodes) AS deleted_count "
+                f"OPTIONAL MATCH (m:{label}) "
+                "RETURN deleted_count, count(m) AS final_count",
+            ).single()
+            assert cleanup["deleted_count"] == 1  # 应该删除了1个节点
+            assert cleanup["final_count"] == 0  # 确认节点已被删除
+        finally:
+            tx.rollback()
 
 
+@pytest.mark.timeout(30)
 def test_minio_bucket_lifecycle(real_minio_client):
     """验证 MinIO 服务可以创建与删除 bucket。"""
     bucket_name = f"test-bucket-{uuid.uuid4().hex[:8]}"
@@ -1,19 +1,22 @@
 """
 健康检查API测试
 """
+import asyncio
+from time import perf_counter_ns
+
 import pytest
-from fastapi.testclient import TestClient
+from httpx import AsyncClient
 
-# 标记所有测试为API测试
-pytestmark = pytest.mark.integration
+# 标记所有测试为API测试（应用内调用，不依赖外部服务），并与模块级客户端共用同一事件循环
+pytestmark = [pytest.mark.unit, pytest.mark.asyncio(loop_scope="module")]
 
 
 class TestHealthAPI:
     """测试健康检查API"""
 
-    def test_health_check(self, client: TestClient):
+    async def test_health_check(self, async_client: AsyncClient):
         """测试健康检查接口"""
-        response = client.get("/api/health")
+        response = await async_client.get("/api/health")
         assert response.status_code == 200
         data = response.json()
         
@@ -28,9 +31,17 @@ class TestHealthAPI:
         assert "api" in data["checks"]
         assert data["checks"]["api"] == "ok"
         
-    def test_readiness_check(self, client: TestClient):
-        """测试就绪检查接口"""
-        response = client.get("/api/ready")
+    @pytest.mark.parametrize(
+        "path,expected_status",
+        [
+            ("/api/ready", "ready"),  # 就绪检查
+            ("/api/live", "alive"),  # 存活检查
+        ],
+        ids=["readiness", "liveness"],
+    )
+    async def test_probe_check(self, async_client: AsyncClient, path: str, expected_status: str):
+        """测试就绪/存活探针接口"""
+        response = await async_client.get(path)
         assert response.status_code == 200
         data = response.json()
         
@@ -39,17 +50,22 @@ class TestHealthAPI:
         assert "timestamp" in data
         
         # 验证状态
-        assert data["status"] == "ready"
-        
-    def test_liveness_check(self, client: TestClient):
-        """测试存活检查接口"""
-        response = client.get("/api/live")
+        assert data["status"] == expected_status
+
+    async def test_concurrent_requests(self, async_client: AsyncClient):
+        """测试并发请求：在同一事件循环中用asyncio.gather并发发起请求"""
+        # 请求只构建一次，避免每次重复解析URL和组装参数
+        request = async_client.build_request("GET", "/api/health")
+        responses = await asyncio.gather(
+            *(async_client.send(request) for _ in range(100))
+        )
+        assert all(r.status_code == 200 for r in responses)
+        assert all(r.json()["status"] == "healthy" for r in responses)
+
+    async def test_health_response_time(self, async_client: AsyncClient):
+        """测试健康检查响应时间（使用单调的纳秒计时器）"""
+        start = perf_counter_ns()
+        response = await async_client.get("/api/health")
+        elapsed_ns = perf_counter_ns() - start
         assert response.status_code == 200
-        data = response.json()
-        
-        # 验证返回的数据结构
-        assert "status" in data
-        assert "timestamp" in data
-        
-        # 验证状态
-        assert data["status"] == "alive"
+        assert elapsed_ns < 1_000_000_000  # 1秒内返回
@@ -2,107 +2,136 @@
 知识库相关的API集成测试
 """
 import pytest
-import uuid
-import random
-import string
-from fastapi.testclient import TestClient
+import httpx
+from httpx import AsyncClient
 from sqlalchemy.orm import Session
-from unittest import mock
 
-# 标记所有测试为知识库和数据库测试
-pytestmark = [pytest.mark.knowledge, pytest.mark.database]
+from api.routes.knowledge_router import MAX_BATCH_CREATE_ITEMS, MAX_BATCH_UPLOAD_FILES
 
-# 生成唯一用户名后缀
-def unique_suffix():
-    return uuid.uuid4().hex[:8]
-    
-# 生成完全随机的用户名
-def random_username(prefix="user"):
-    random_str = ''.join(random.choice(string.ascii_letters) for _ in range(10))
-    return f"{prefix}_{random_str}_{unique_suffix()}"
+# 标记所有测试为知识库和数据库测试，并与模块级客户端共用同一事件循环
+pytestmark = [pytest.mark.knowledge, pytest.mark.database, pytest.mark.asyncio(loop_scope="module")]
+
+
+def _encode_upload(*files: tuple[str, bytes], field: str = "file"):
+    """预先编码文件上传的multipart请求体，files 为 (文件名, 内容) 元组，返回 (body, headers)"""
+    request = httpx.Request(
+        "POST", "http://test", files=[(field, (filename, content, "text/plain")) for filename, content in files]
+    )
+    return request.read(), {"Content-Type": request.headers["Content-Type"]}
+
+
+# 上传用的请求体在模块加载时编码一次
+UPLOAD_TEST_FILE = _encode_upload(("test.txt", "这是一个测试文件。".encode("utf-8")))
+UPLOAD_DETAIL_FILE = _encode_upload(("detail_test.txt", "这是一个用于测试获取文档详情的文件。".encode("utf-8")))
+UPLOAD_DELETE_FILE = _encode_upload(("delete_test.txt", "这是一个待删除的文件。".encode("utf-8")))
+BATCH_UPLOAD_FILES = _encode_upload(
+    ("batch_a.txt", "批量上传文件A".encode("utf-8")),
+    ("batch_b.txt", "批量上传文件B".encode("utf-8")),
+    field="files",
+)
+# httpx 不会为空文件名写出 filename 参数，这里手工构造一个 filename="" 的文件分段
+BATCH_UPLOAD_EMPTY_FILENAME = (
+    b'--emptyname\r\n'
+    b'Content-Disposition: form-data; name="files"; filename=""\r\n'
+    b'Content-Type: text/plain\r\n\r\n'
+    b'no name\r\n'
+    b'--emptyname--\r\n',
+    {"Content-Type": "multipart/form-data; boundary=emptyname"},
+)
+
+
+@pytest.fixture(autouse=True)
+def _override_auth(override_auth):
+    """本模块通过依赖覆盖注入模拟用户，无需初始化管理员和携带令牌"""
 
 
 class TestKnowledgeAPI:
     """测试知识库相关的API"""
 
-    def test_create_knowledge_base(self, db_client: TestClient):
+    async def test_create_knowledge_base(self, async_db_client: AsyncClient, mock_create_kb_backend, unique_suffix):
         """测试创建知识库"""
-        # 1. 初始化管理员以获取令牌
-        admin_username = random_username("kb_admin")
-        admin_data = {"username": admin_username, "password": "adminpass"}
-        response = db_client.post("/api/auth/initialize", json=admin_data)
-        assert response.status_code == 200
-        admin_token = response.json()["access_token"]
-        headers = {"Authorization": f"Bearer {admin_token}"}
-
-        # 2. 创建知识库
+        # 1. 创建知识库
         kb_name = f"测试知识库_{unique_suffix()}"
         kb_data = {
             "name": kb_name,
             "description": "这是一个测试知识库",
             "embed_model": "test-embedding-model"
         }
-        response = db_client.post("/api/knowledge/databases", json=kb_data, headers=headers)
+        response = await async_db_client.post("/api/knowledge/databases", json=kb_data)
         assert response.status_code == 200
         result = response.json()
 
-        # 3. 验证响应
+        # 2. 验证响应
         assert result["success"] is True
         assert "db_id" in result["data"]
         assert result["data"]["name"] == kb_name
+        mock_create_kb_backend.assert_awaited_once()
+        assert mock_create_kb_backend.await_args.kwargs["database_name"] == kb_name
 
-    def test_get_knowledge_bases(self, db_client: TestClient):
+    async def test_get_knowledge_bases(self, async_db_client: AsyncClient, mock_create_kb_backend, unique_suffix):
         """测试获取知识库列表"""
-        # 1. 初始化管理员以获取令牌
-        admin_username = random_username("kb_admin_list")
-        admin_data = {"username": admin_username, "password": "adminpass"}
-        response = db_client.post("/api/auth/initialize", json=admin_data)
+        # 1. 通过批量接口一次创建多个知识库
+        kb_names = [f"列表测试知识库_{i}_{unique_suffix()}" for i in range(3)]
+        batch_data = {"items": [{"name": name, "description": "列表测试"} for name in kb_names]}
+        response = await async_db_client.post("/api/knowledge/databases/batch", json=batch_data)
         assert response.status_code == 200
-        admin_token = response.json()["access_token"]
-        headers = {"Authorization": f"Bearer {admin_token}"}
-
-        # 2. 创建多个知识库
-        kb_names = []
-        for i in range(3):
-            kb_name = f"列表测试知识库_{i}_{unique_suffix()}"
-            kb_names.append(kb_name)
-            kb_data = {"name": kb_name, "description": "列表测试"}
-            response = db_client.post("/api/knowledge/databases", json=kb_data, headers=headers)
-            assert response.status_code == 200
-
-        # 3. 获取知识库列表
-        response = db_client.get("/api/knowledge/databases", headers=headers)
+        batch_result = response.json()
+        assert batch_result["success"] is True
+        assert [item["name"] for item in batch_result["data"]] == kb_names
+        assert len({item["db_id"] for item in batch_result["data"]}) == 3
+        assert [item["backend_status"] for item in batch_result["data"]] == ["created"] * 3
+        assert mock_create_kb_backend.await_count == 3
+
+        # 2. 获取知识库列表
+        response = await async_db_client.get("/api/knowledge/databases")
         assert response.status_code == 200
         databases = response.json()
 
-        # 4. 验证响应
+        # 3. 验证响应
         assert isinstance(databases, list)
         assert len(databases) >= 3
         
-        # 5. 验证创建的知识库都在列表中
+        # 4. 验证创建的知识库都在列表中
         response_kb_names = [db['name'] for db in databases]
         for name in kb_names:
             assert name in response_kb_names
 
-    def test_get_knowledge_base_detail(self, db_client: TestClient):
-        """测试获取单个知识库的详细信息"""
-        # 1. 初始化管理员并创建知识库
-        admin_username = random_username("kb_admin_detail")
-        admin_data = {"username": admin_username, "password": "adminpass"}
-        response = db_client.post("/api/auth/initialize", json=admin_data)
+    async def test_batch_create_knowledge_bases_backend_failure(self, async_db_client: AsyncClient, mock_create_kb_backend, unique_suffix):
+        """测试批量创建知识库时单个后端初始化失败只体现在该项的状态中"""
+        mock_create_kb_backend.side_effect = [{}, RuntimeError("backend down"), {}]
+        kb_names = [f"批量失败测试知识库_{i}_{unique_suffix()}" for i in range(3)]
+        response = await async_db_client.post("/api/knowledge/databases/batch", json={"items": [{"name": name} for name in kb_names]})
         assert response.status_code == 200
-        admin_token = response.json()["access_token"]
-        headers = {"Authorization": f"Bearer {admin_token}"}
+        results = response.json()["data"]
+        assert [item["backend_status"] for item in results] == ["created", "failed", "created"]
+        assert results[1]["backend_error"] == "backend down"
 
+        # 后端失败的知识库记录仍然已写入
+        response = await async_db_client.get(f"/api/knowledge/databases/{results[1]['db_id']}")
+        assert response.status_code == 200
+
+    async def test_batch_create_knowledge_bases_empty(self, async_db_client: AsyncClient, mock_create_kb_backend):
+        """测试批量创建知识库时拒绝空列表"""
+        response = await async_db_client.post("/api/knowledge/databases/batch", json={"items": []})
+        assert response.status_code == 422
+        mock_create_kb_backend.assert_not_awaited()
+
+    async def test_batch_create_knowledge_bases_too_many(self, async_db_client: AsyncClient, mock_create_kb_backend):
+        """测试批量创建知识库时拒绝超过上限的条目数"""
+        items = [{"name": f"超限知识库_{i}"} for i in range(MAX_BATCH_CREATE_ITEMS + 1)]
+        response = await async_db_client.post("/api/knowledge/databases/batch", json={"items": items})
+        assert response.status_code == 422
+        mock_create_kb_backend.assert_not_awaited()
+
+    async def test_get_knowledge_base_detail(self, async_db_client: AsyncClient, make_kb, unique_suffix):
+        """测试获取单个知识库的详细信息"""
+        # 1. 创建知识库
         kb_name = f"详情测试知识库_{unique_suffix()}"
         kb_desc = "这是一个用于测试获取详情的知识库"
-        kb_data = {"name": kb_name, "description": kb_desc}
-        response = db_client.post("/api/knowledge/databases", json=kb_data, headers=headers)
-        assert response.status_code == 200
-        db_id = response.json()["data"]["db_id"]
+        db_id = await make_kb(kb_name, description=kb_desc)
 
         # 2. 获取该知识库的详情
-        response = db_client.get(f"/api/knowledge/databases/{db_id}", headers=headers)
+        response = await async_db_client.get(f"/api/knowledge/databases/{db_id}")
         assert response.status_code == 200
         detail_data = response.json()
 
@@ -118,89 +147,55 @@ class TestKnowledgeAPI:
 
         # 4. 测试获取不存在的知识库
         non_existent_db_id = "kb_nonexistent"
-        response = db_client.get(f"/api/knowledge/databases/{non_existent_db_id}", headers=headers)
+        response = await async_db_client.get(f"/api/knowledge/databases/{non_existent_db_id}")
         assert response.status_code == 404
 
-    def test_update_knowledge_base(self, db_client: TestClient):
+    async def test_update_knowledge_base(self, async_db_client: AsyncClient, make_kb, unique_suffix):
         """测试更新知识库信息"""
-        # 1. 初始化管理员并创建知识库
-        admin_username = random_username("kb_admin_update")
-        admin_data = {"username": admin_username, "password": "adminpass"}
-        response = db_client.post("/api/auth/initialize", json=admin_data)
-        assert response.status_code == 200
-        admin_token = response.json()["access_token"]
-        headers = {"Authorization": f"Bearer {admin_token}"}
-
-        kb_name = f"更新前知识库_{unique_suffix()}"
-        kb_data = {"name": kb_name, "description": "更新前"}
-        response = db_client.post("/api/knowledge/databases", json=kb_data, headers=headers)
-        assert response.status_code == 200
-        db_id = response.json()["data"]["db_id"]
+        # 1. 创建知识库
+        db_id = await make_kb(f"更新前知识库_{unique_suffix()}", description="更新前")
 
         # 2. 更新知识库信息
         updated_kb_name = f"更新后知识库_{unique_suffix()}"
         updated_kb_desc = "更新后描述"
         update_data = {"name": updated_kb_name, "description": updated_kb_desc}
-        response = db_client.put(f"/api/knowledge/databases/{db_id}", json=update_data, headers=headers)
+        response = await async_db_client.put(f"/api/knowledge/databases/{db_id}", json=update_data)
         assert response.status_code == 200
         update_result = response.json()
         assert update_result["success"] is True
         assert update_result["data"]["name"] == updated_kb_name
 
         # 3. 获取详情以验证更新
-        response = db_client.get(f"/api/knowledge/databases/{db_id}", headers=headers)
+        response = await async_db_client.get(f"/api/knowledge/databases/{db_id}")
         assert response.status_code == 200
         detail_data = response.json()["data"]["database"]
         assert detail_data["name"] == updated_kb_name
         assert detail_data["description"] == updated_kb_desc
 
-    def test_delete_knowledge_base(self, db_client: TestClient):
+    async def test_delete_knowledge_base(self, async_db_client: AsyncClient, make_kb, unique_suffix):
         """测试删除知识库"""
-        # 1. 初始化管理员并创建知识库
-        admin_username = random_username("kb_admin_delete")
-        admin_data = {"username": admin_username, "password": "adminpass"}
-        response = db_client.post("/api/auth/initialize", json=admin_data)
-        assert response.status_code == 200
-        admin_token = response.json()["access_token"]
-        headers = {"Authorization": f"Bearer {admin_token}"}
-
-        kb_name = f"待删除知识库_{unique_suffix()}"
-        kb_data = {"name": kb_name}
-        response = db_client.post("/api/knowledge/databases", json=kb_data, headers=headers)
-        assert response.status_code == 200
-        db_id = response.json()["data"]["db_id"]
+        # 1. 创建知识库
+        db_id = await make_kb(f"待删除知识库_{unique_suffix()}")
 
         # 2. 删除知识库
-        response = db_client.delete(f"/api/knowledge/databases/{db_id}", headers=headers)
+        response = await async_db_client.delete(f"/api/knowledge/databases/{db_id}")
         assert response.status_code == 200
         delete_result = response.json()
         assert delete_result["success"] is True
         assert delete_result["message"] == "知识库删除成功"
 
         # 3. 验证知识库已被删除
-        response = db_client.get(f"/api/knowledge/databases/{db_id}", headers=headers)
+        response = await async_db_client.get(f"/api/knowledge/databases/{db_id}")
         assert response.status_code == 404
 
-    def test_upload_file_to_kb(self, db_client: TestClient):
+    async def test_upload_file_to_kb(self, async_db_client: AsyncClient, make_kb, unique_suffix):
         """测试向知识库上传文件"""
-        # 1. 初始化管理员并创建知识库
-        admin_username = random_username("kb_admin_upload")
-        admin_data = {"username": admin_username, "password": "adminpass"}
-        response = db_client.post("/api/auth/initialize", json=admin_data)
-        assert response.status_code == 200
-        admin_token = response.json()["access_token"]
-        headers = {"Authorization": f"Bearer {admin_token}"}
-
-        kb_name = f"文件上传测试知识库_{unique_suffix()}"
-        kb_data = {"name": kb_name}
-        response = db_client.post("/api/knowledge/databases", json=kb_data, headers=headers)
-        assert response.status_code == 200
-        db_id = response.json()["data"]["db_id"]
+        # 1. 创建知识库
+        db_id = await make_kb(f"文件上传测试知识库_{unique_suffix()}")
 
         # 2. 上传文件
-        file_content = "这是一个测试文件。".encode("utf-8")
-        files = {"file": ("test.txt", file_content, "text/plain")}
-        response = db_client.post(f"/api/knowledge/files/upload?db_id={db_id}", files=files, headers=headers)
+        body, headers = UPLOAD_TEST_FILE
+        response = await async_db_client.post(f"/api/knowledge/files/upload?db_id={db_id}", content=body, headers=headers)
         assert response.status_code == 200
         upload_result = response.json()
 
@@ -210,36 +205,65 @@ class TestKnowledgeAPI:
         assert upload_result["data"]["filename"] == "test.txt"
 
         # 4. 验证知识库文件数量已更新
-        response = db_client.get(f"/api/knowledge/databases/{db_id}", headers=headers)
+        response = await async_db_client.get(f"/api/knowledge/databases/{db_id}")
         assert response.status_code == 200
         detail_data = response.json()["data"]["database"]
         assert detail_data["file_count"] == 1
 
-    def test_get_document_detail(self, db_client: TestClient):
-        """测试获取文档详细信息"""
-        # 1. 初始化管理员并创建知识库
-        admin_username = random_username("kb_admin_doc_detail")
-        admin_data = {"username": admin_username, "password": "adminpass"}
-        response = db_client.post("/api/auth/initialize", json=admin_data)
+    async def test_batch_upload_files_to_kb(self, async_db_client: AsyncClient, make_kb, unique_suffix):
+        """测试一次请求向知识库批量上传多个文件"""
+        # 1. 创建知识库
+        db_id = await make_kb(f"批量上传测试知识库_{unique_suffix()}")
+
+        # 2. 批量上传文件
+        body, headers = BATCH_UPLOAD_FILES
+        response = await async_db_client.post(f"/api/knowledge/files/upload/batch?db_id={db_id}", content=body, headers=headers)
         assert response.status_code == 200
-        admin_token = response.json()["access_token"]
-        headers = {"Authorization": f"Bearer {admin_token}"}
+        upload_result = response.json()
 
-        kb_name = f"文档详情测试知识库_{unique_suffix()}"
-        kb_data = {"name": kb_name}
-        response = db_client.post("/api/knowledge/databases", json=kb_data, headers=headers)
+        # 3. 验证上传结果
+        assert upload_result["success"] is True
+        assert len(upload_result["data"]) == 2
+        assert [item["filename"] for item in upload_result["data"]] == ["batch_a.txt", "batch_b.txt"]
+
+        # 4. 验证知识库文件数量已更新
+        response = await async_db_client.get(f"/api/knowledge/databases/{db_id}")
         assert response.status_code == 200
-        db_id = response.json()["data"]["db_id"]
+        assert response.json()["data"]["database"]["file_count"] == 2
+
+    async def test_batch_upload_files_unknown_kb(self, async_db_client: AsyncClient):
+        """测试向不存在的知识库批量上传文件"""
+        body, headers = BATCH_UPLOAD_FILES
+        response = await async_db_client.post("/api/knowledge/files/upload/batch?db_id=kb_missing", content=body, headers=headers)
+        assert response.status_code == 404
+
+    async def test_batch_upload_files_empty_filename(self, async_db_client: AsyncClient):
+        """测试批量上传时拒绝空文件名"""
+        body, headers = BATCH_UPLOAD_EMPTY_FILENAME
+        response = await async_db_client.post("/api/knowledge/files/upload/batch", content=body, headers=headers)
+        assert response.status_code == 400
+
+    async def test_batch_upload_files_too_many(self, async_db_client: AsyncClient):
+        """测试批量上传时拒绝超过上限的文件数"""
+        body, headers = _encode_upload(
+            *[(f"over_{i}.txt", b"x") for i in range(MAX_BATCH_UPLOAD_FILES + 1)], field="files"
+        )
+        response = await async_db_client.post("/api/knowledge/files/upload/batch", content=body, headers=headers)
+        assert response.status_code == 400
+
+    async def test_get_document_detail(self, async_db_client: AsyncClient, make_kb, unique_suffix):
+        """测试获取文档详细信息"""
+        # 1. 创建知识库
+        db_id = await make_kb(f"文档详情测试知识库_{unique_suffix()}")
 
         # 2. 上传文件
-        file_content = "这是一个用于测试获取文档详情的文件。".encode("utf-8")
-        files = {"file": ("detail_test.txt", file_content, "text/plain")}
-        response = db_client.post(f"/api/knowledge/files/upload?db_id={db_id}", files=files, headers=headers)
+        body, headers = UPLOAD_DETAIL_FILE
+        response = await async_db_client.post(f"/api/knowledge/files/upload?db_id={db_id}", content=body, headers=headers)
         assert response.status_code == 200
         file_id = response.json()["data"]["file_id"]
 
         # 3. 获取文档详情
-        response = db_client.get(f"/api/knowledge/databases/{db_id}/documents/{file_id}", headers=headers)
+        response = await async_db_client.get(f"/api/knowledge/databases/{db_id}/documents/{file_id}")
         assert response.status_code == 200
         doc_detail = response.json()
 
@@ -251,71 +275,51 @@ class TestKnowledgeAPI:
 
         # 5. 测试获取不存在的文档
         non_existent_doc_id = "doc_nonexistent"
-        response = db_client.get(f"/api/knowledge/databases/{db_id}/documents/{non_existent_doc_id}", headers=headers)
+        response = await async_db_client.get(f"/api/knowledge/databases/{db_id}/documents/{non_existent_doc_id}")
         assert response.status_code == 404
 
-    def test_delete_document(self, db_client: TestClient):
+    async def test_delete_document(self, async_db_client: AsyncClient, make_kb, unique_suffix):
         """测试删除知识库中的文档"""
-        # 1. 初始化管理员并创建知识库
-        admin_username = random_username("kb_admin_doc_delete")
-        admin_data = {"username": admin_username, "password": "adminpass"}
-        response = db_client.post("/api/auth/initialize", json=admin_data)
-        assert response.status_code == 200
-        admin_token = response.json()["access_token"]
-        headers = {"Authorization": f"Bearer {admin_token}"}
-
-        kb_name = f"文档删除测试知识库_{unique_suffix()}"
-        kb_data = {"name": kb_name}
-        response = db_client.post("/api/knowledge/databases", json=kb_data, headers=headers)
-        assert response.status_code == 200
-        db_id = response.json()["data"]["db_id"]
+        # 1. 创建知识库
+        db_id = await make_kb(f"文档删除测试知识库_{unique_suffix()}")
 
         # 2. 上传文件
-        file_content = "这是一个待删除的文件。".encode("utf-8")
-        files = {"file": ("delete_test.txt", file_content, "text/plain")}
-        response = db_client.post(f"/api/knowledge/files/upload?db_id={db_id}", files=files, headers=headers)
+        body, headers = UPLOAD_DELETE_FILE
+        response = await async_db_client.post(f"/api/knowledge/files/upload?db_id={db_id}", content=body, headers=headers)
         assert response.status_code == 200
         file_id = response.json()["data"]["file_id"]
 
         # 3. 删除文档
-        response = db_client.delete(f"/api/knowledge/databases/{db_id}/documents/{file_id}", headers=headers)
+        response = await async_db_client.delete(f"/api/knowledge/databases/{db_id}/documents/{file_id}")
         assert response.status_code == 200
         delete_result = response.json()
         assert delete_result["success"] is True
 
         # 4. 验证文档已被删除
-        response = db_client.get(f"/api/knowledge/databases/{db_id}/documents/{file_id}", headers=headers)
+        response = await async_db_client.get(f"/api/knowledge/databases/{db_id}/documents/{file_id}")
         assert response.status_code == 404
 
         # 5. 验证知识库文件数量已更新为0
-        response = db_client.get(f"/api/knowledge/databases/{db_id}", headers=headers)
+        response = await async_db_client.get(f"/api/knowledge/databases/{db_id}")
         assert response.status_code == 200
         detail_data = response.json()["data"]["database"]
         assert detail_data["file_count"] == 0
 
-    @mock.patch('api.routes.knowledge_router.knowledge_base.aquery')
-    def test_query_knowledge_base(self, mock_aquery, db_client: TestClient):
+    async def test_query_knowledge_base(self, async_db_client: AsyncClient, make_kb, async_mock_factory, monkeypatch, unique_suffix):
         """测试查询知识库"""
         # 1. 设置 mock 返回值
-        mock_aquery.return_value = {"results": [{"text": "这是模拟的查询结果"}]}
-
-        # 2. 初始化管理员并创建知识库
-        admin_username = random_username("kb_admin_query")
-        admin_data = {"username": admin_username, "password": "adminpass"}
-        response = db_client.post("/api/auth/initialize", json=admin_data)
-        assert response.status_code == 200
-        admin_token = response.json()["access_token"]
-        headers = {"Authorization": f"Bearer {admin_token}"}
+        mock_aquery = async_mock_factory(
+            "knowledge_base.aquery",
+            return_value={"results": [{"text": "这是模拟的查询结果"}]},
+        )
+        monkeypatch.setattr("api.routes.knowledge_router.knowledge_base.aquery", mock_aquery)
 
-        kb_name = f"查询测试知识库_{unique_suffix()}"
-        kb_data = {"name": kb_name}
-        response = db_client.post("/api/knowledge/databases", json=kb_data, headers=headers)
-        assert response.status_code == 200
-        db_id = response.json()["data"]["db_id"]
+        # 2. 创建知识库
+        db_id = await make_kb(f"查询测试知识库_{unique_suffix()}")
 
         # 3. 查询知识库
         query_data = {"query": "测试查询"}
-        response = db_client.post(f"/api/knowledge/databases/{db_id}/query", json=query_data, headers=headers)
+        response = await async_db_client.post(f"/api/knowledge/databases/{db_id}/query", json=query_data)
         assert response.status_code == 200
         query_result = response.json()
 
@@ -325,5 +329,5 @@ class TestKnowledgeAPI:
         mock_aquery.assert_called_once_with(query_text="测试查询", db_id=db_id)
 
         # 5. 测试查询不存在的知识库
-        response = db_client.post("/api/knowledge/databases/kb_nonexistent/query", json=query_data, headers=headers)
+        response = await async_db_client.post("/api/knowledge/databases/kb_nonexistent/query", json=query_data)
         assert response.status_code == 404